@@ -1,42 +1,74 @@
 """Flask application initialization."""
 from flask import Flask
+import cv2
 from config import config
 from app.camera import get_camera
-from app.stream_manager import get_stream_manager
-from app.routes import main_bp
+from app.routes import main_bp, init_routes
+from app.json_provider import OrjsonProvider
+import atexit
 import os
 
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Load configuration
-config_name = os.environ.get('FLASK_ENV', 'default')
-app.config.from_object(config[config_name])
-
-# Initialize camera and store in app config for access by routes
-camera = get_camera(app.config)
-app.config['camera'] = camera
-
-# Initialize stream manager if RTSP is enabled
-if app.config.get('RTSP_ENABLED', True):
-    stream_manager = get_stream_manager(app.config)
-    app.config['stream_manager'] = stream_manager
-    # Link camera with stream manager
-    camera.set_stream_manager(stream_manager)
-else:
-    app.config['stream_manager'] = None
-
-# Register blueprints
-app.register_blueprint(main_bp)
-
-
-@app.teardown_appcontext
-def cleanup(error=None):
-    """Cleanup resources on app shutdown."""
-    # Stop RTSP streaming if active
-    if app.config.get('stream_manager'):
-        app.config['stream_manager'].stop_streaming()
-    # Camera cleanup is handled by the global instance
-    pass
-
+def create_app(config_name=None):
+    """Create and configure the Flask application.
+    
+    Args:
+        config_name: Configuration name ('development', 'production' or
+            'default'). Defaults to the FLASK_ENV environment variable.
+    
+    Returns:
+        Configured Flask application
+    """
+    # Initialize Flask app
+    app = Flask(__name__)
+    # Serialize every JSON response with orjson
+    app.json = OrjsonProvider(app)
+    
+    # Load configuration
+    if config_name is None:
+        config_name = os.environ.get('FLASK_ENV', 'default')
+    app.config.from_object(config[config_name])
+    
+    # Let OpenCV use its optimized code paths and parallelize encoding across
+    # half the cores, leaving the rest for request handling and capture
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(max(2, (os.cpu_count() or 2) // 2))
+    # Route UMat work through OpenCL on hosts with a usable GPU
+    cv2.ocl.setUseOpenCL(cv2.ocl.haveOpenCL())
+    
+    # Initialize camera and store in app config for access by routes
+    camera = get_camera(app.config)
+    app.config['camera'] = camera
+    
+    # Initialize stream manager if RTSP is enabled
+    if app.config.get('RTSP_ENABLED', True):
+        # Imported here so a disabled RTSP path never loads the streaming stack
+        from app.stream_manager import get_stream_manager
+        stream_manager = get_stream_manager(app.config)
+        app.config['stream_manager'] = stream_manager
+        # Link camera with stream manager
+        camera.set_stream_manager(stream_manager)
+    else:
+        app.config['stream_manager'] = None
+    
+    # Bind shared objects to the routes once instead of per request
+    init_routes(
+        camera,
+        app.config['stream_manager'],
+        app.config['RECORDINGS_DIR'],
+        app.config.get('X_ACCEL_REDIRECT_PREFIX')
+    )
+    
+    # Register blueprints
+    app.register_blueprint(main_bp)
+    
+    def cleanup():
+        """Cleanup resources on app shutdown."""
+        # Stop RTSP streaming if active
+        if app.config.get('stream_manager'):
+            app.config['stream_manager'].stop_streaming()
+        # Camera cleanup is handled by the global instance
+    
+    atexit.register(cleanup)
+    
+    return app
@@ -5,7 +5,83 @@ import datetime
 import os
 import numpy as np
 import time
-from typing import Optional
+import queue
+from typing import Optional, Tuple
+
+
+class BroadcastHub:
+    """Fans out one encoded MJPEG frame to any number of viewers.
+    
+    A single producer publishes each JPEG once; viewers wait for a sequence
+    number newer than the one they last sent and all yield the same bytes
+    object, so N viewers cost the same encode as one.
+    """
+    
+    # Multipart framing for the MJPEG stream
+    PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+    PART_FOOTER = b'\r\n'
+    
+    def __init__(self):
+        """Initialize an empty hub."""
+        self._cond = threading.Condition()
+        self.latest_jpeg = None
+        self.part_header = None
+        self.seq = 0
+    
+    def publish(self, jpeg: Optional[bytes]):
+        """Publish a new frame and wake all waiting viewers.
+        
+        Args:
+            jpeg: JPEG-encoded frame, or None to signal that no frame is
+                available (read failure or camera released).
+        """
+        # Build the multipart header once per frame rather than per viewer
+        part_header = self.PART_HEADER % len(jpeg) if jpeg is not None else None
+        with self._cond:
+            self.latest_jpeg = jpeg
+            self.part_header = part_header
+            self.seq += 1
+            self._cond.notify_all()
+    
+    def wait(self, last_seq: int, timeout: float) -> Tuple[Optional[bytes], int]:
+        """Wait for a frame newer than last_seq.
+        
+        Args:
+            last_seq: Sequence number of the frame the caller already has
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            Tuple of (latest JPEG or None, its sequence number). On timeout
+            the current frame is returned with an unchanged sequence number.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != last_seq, timeout=timeout)
+            return self.latest_jpeg, self.seq
+    
+    def part_header_for(self, jpeg: bytes) -> bytes:
+        """Get the multipart header for a frame, reusing the published one."""
+        with self._cond:
+            if jpeg is self.latest_jpeg and self.part_header is not None:
+                return self.part_header
+        return self.PART_HEADER % len(jpeg)
+
+
+def put_latest(frame_queue: queue.Queue, item) -> None:
+    """Put an item on a bounded queue, discarding the oldest entry if full.
+    
+    Args:
+        frame_queue: Bounded queue to add to
+        item: Item to add
+    """
+    while True:
+        try:
+            frame_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                pass
 
 
 class Camera:
@@ -21,6 +97,21 @@ class Camera:
     CLEANUP_CHECK_INTERVAL = 2
     # Cleanup thread join timeout in seconds
     CLEANUP_THREAD_JOIN_TIMEOUT = 3
+    # Extra seconds the cleanup thread sleeps past a pending idle timeout
+    CLEANUP_WAKE_MARGIN = 0.05
+    # Seconds a consumer waits for the grabber to publish a new frame
+    FRAME_WAIT_TIMEOUT = 1.0
+    # Back-off in seconds after a failed camera read
+    READ_RETRY_DELAY = 0.1
+    # Frames buffered for the recording writer before new ones are dropped
+    # (about one second at 30 FPS; each frame is a full raw image)
+    RECORDING_QUEUE_SIZE = 30
+    # Seconds to wait for the recording writer to flush when stopping
+    WRITER_THREAD_JOIN_TIMEOUT = 10
+    # Distinct rendered error messages kept by create_error_frame()
+    ERROR_FRAME_CACHE_SIZE = 16
+    # GStreamer muxer for each VIDEO_FORMAT when hardware encoding
+    GSTREAMER_MUXERS = {'mp4': 'mp4mux', 'mov': 'qtmux', 'avi': 'avimux'}
     
     def __init__(self, config):
         """Initialize camera with configuration."""
@@ -28,11 +119,24 @@ class Camera:
         self.camera = None
         self.is_recording = False
         self.video_writer = None
+        # Guards state transitions (recording start/stop, viewer count, idle
+        # release); the capture and streaming hot paths never take it
         self.lock = threading.Lock()
-        self.frame = None
+        # Serializes opening the device; separate from self.lock because
+        # start_recording() initializes the camera while holding that one
+        self._init_lock = threading.Lock()
+        # Recording runs on its own thread fed through a bounded queue so
+        # disk and codec stalls never hold up capture or viewers
+        self._write_queue = None
+        self._writer_thread = None
+        # Set while the stream manager's FFMPEG writes the recording instead
+        self._recording_via_stream = False
+        self._dropped_frames = 0
         self.recording_filename = None
         self.camera_error = None
         self.error_frame = None
+        self._error_frame_cache = {}
+        self._error_template = None
         
         # Camera lifecycle management
         self.active_viewers = 0
@@ -41,13 +145,51 @@ class Camera:
         if hasattr(config, 'get'):
             self.idle_timeout = config.get('CAMERA_IDLE_TIMEOUT', 10)
             self.rtsp_enabled = config.get('RTSP_ENABLED', True)
+            self.stream_fps = config.get('CAMERA_STREAM_FPS', 15)
+            self.stream_scale = config.get('CAMERA_STREAM_SCALE', 1.0)
+            jpeg_quality = config.get('JPEG_QUALITY', 80)
+            self.camera_fourcc = config.get('CAMERA_FOURCC', 'MJPG')
+            self.hw_encode = config.get('HW_ENCODE', False)
+            self.hw_encoder = config.get('HW_ENCODER', 'vaapih264enc')
         else:
             self.idle_timeout = getattr(config, 'CAMERA_IDLE_TIMEOUT', 10)
             self.rtsp_enabled = getattr(config, 'RTSP_ENABLED', True)
+            self.stream_fps = getattr(config, 'CAMERA_STREAM_FPS', 15)
+            self.stream_scale = getattr(config, 'CAMERA_STREAM_SCALE', 1.0)
+            jpeg_quality = getattr(config, 'JPEG_QUALITY', 80)
+            self.camera_fourcc = getattr(config, 'CAMERA_FOURCC', 'MJPG')
+            self.hw_encode = getattr(config, 'HW_ENCODE', False)
+            self.hw_encoder = getattr(config, 'HW_ENCODER', 'vaapih264enc')
+        # The grabber paces viewer frames by 1 / CAMERA_STREAM_FPS
+        if not self.stream_fps > 0:
+            print(f"Warning: Invalid CAMERA_STREAM_FPS {self.stream_fps}, expected > 0; using 15")
+            self.stream_fps = 15
+        # Viewer frames can only shrink and must keep at least one pixel per
+        # side; anything else would make every resize in the grabber fail
+        smallest_side = min(self.config['CAMERA_WIDTH'], self.config['CAMERA_HEIGHT'])
+        if not 0 < self.stream_scale <= 1 or round(smallest_side * self.stream_scale) < 1:
+            print(f"Warning: Invalid CAMERA_STREAM_SCALE {self.stream_scale}, expected 0 < scale <= 1; using 1.0")
+            self.stream_scale = 1.0
+        # Baseline JPEG without Huffman optimization is the fastest to encode
+        self._jpeg_params = [
+            cv2.IMWRITE_JPEG_QUALITY, jpeg_quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, 0
+        ]
         self.cleanup_thread = None
         self.cleanup_stop_event = threading.Event()
+        self.cleanup_wake_event = threading.Event()
         self._start_cleanup_thread()
         
+        # Frame grabber: a single thread reads the camera and publishes its
+        # frames; viewers and the RTSP worker only consume them. Raw frames go
+        # to the subscribed queues (see add_frame_queue), while MJPEG viewers
+        # are served from the hub at CAMERA_STREAM_FPS.
+        self._frame_queues = ()
+        self._frame_queues_lock = threading.Lock()
+        self.hub = BroadcastHub()
+        self._grab_thread = None
+        
         # Stream manager reference (will be set by app initialization)
         self.stream_manager = None
         
@@ -60,20 +202,30 @@ class Camera:
         Returns:
             JPEG-encoded image bytes, or None if encoding fails.
         """
+        # Error frames only depend on the message, so each is rendered once
+        cached = self._error_frame_cache.get(message)
+        if cached is not None:
+            return cached
+        
         width = self.config['CAMERA_WIDTH']
         height = self.config['CAMERA_HEIGHT']
-        
-        # Create a dark gray background
-        frame = np.zeros((height, width, 3), dtype=np.uint8)
-        frame[:] = (50, 50, 50)
-        
-        # Add error icon (red X)
         center_x, center_y = width // 2, height // 3
         size = min(width, height) // 6
-        cv2.line(frame, (center_x - size, center_y - size), 
-                (center_x + size, center_y + size), (0, 0, 255), 5)
-        cv2.line(frame, (center_x + size, center_y - size), 
-                (center_x - size, center_y + size), (0, 0, 255), 5)
+        
+        # The background and icon are shared by every message
+        if self._error_template is None:
+            # Create a dark gray background
+            template = np.full((height, width, 3), 50, dtype=np.uint8)
+            
+            # Add error icon (red X)
+            cv2.line(template, (center_x - size, center_y - size), 
+                    (center_x + size, center_y + size), (0, 0, 255), 5)
+            cv2.line(template, (center_x + size, center_y - size), 
+                    (center_x - size, center_y + size), (0, 0, 255), 5)
+            self._error_template = template
+        # Drawing and encoding on a UMat lets OpenCV's transparent API run
+        # them through OpenCL when enabled; wrapping also copies the template
+        frame = cv2.UMat(self._error_template)
         
         # Add text
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -95,9 +247,15 @@ class Camera:
                 cv2.putText(frame, line, (text_x, text_y), font, font_scale, color, font_thickness)
         
         # Encode to JPEG
-        ret, buffer = cv2.imencode('.jpg', frame)
+        ret, buffer = cv2.imencode('.jpg', frame, self._jpeg_params)
         if ret:
-            return buffer.tobytes()
+            # Viewer threads share the cache and another one may clear it at
+            # any point, so the frame is returned from a local reference
+            error_frame = buffer.tobytes()
+            if len(self._error_frame_cache) >= self.ERROR_FRAME_CACHE_SIZE:
+                self._error_frame_cache.clear()
+            self._error_frame_cache[message] = error_frame
+            return error_frame
         return None
     
     def _get_error_frame_with_fallback(self, error_msg: str, cache: bool = True) -> Optional[bytes]:
@@ -125,73 +283,268 @@ class Camera:
             self.cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
             self.cleanup_thread.start()
     
+    def _is_rtsp_active(self) -> bool:
+        """Check RTSP streaming status safely."""
+        if self.stream_manager is None:
+            return False
+        try:
+            return self.stream_manager.is_active()
+        except (AttributeError, RuntimeError):
+            # AttributeError: stream_manager became None
+            # RuntimeError: stream_manager in inconsistent state
+            return False
+    
     def _cleanup_worker(self):
-        """Background worker that releases camera when idle."""
-        while not self.cleanup_stop_event.is_set():
-            time.sleep(self.CLEANUP_CHECK_INTERVAL)
+        """Background worker that releases camera when idle.
+        
+        The worker sleeps on an event rather than polling blindly: it wakes
+        when the last viewer leaves, when release() stops it, or exactly
+        when the idle timeout of an unused camera is due to expire.
+        """
+        wait_time = self.CLEANUP_CHECK_INTERVAL
+        while True:
+            self.cleanup_wake_event.wait(wait_time)
+            self.cleanup_wake_event.clear()
+            if self.cleanup_stop_event.is_set():
+                break
+            wait_time = self.CLEANUP_CHECK_INTERVAL
             
             # Check if camera should be released due to inactivity
             # All checks done inside the lock to prevent race conditions
             with self.lock:
-                # Check RTSP streaming status safely
-                rtsp_active = False
-                if self.stream_manager is not None:
-                    try:
-                        rtsp_active = self.stream_manager.is_active()
-                    except (AttributeError, RuntimeError):
-                        # AttributeError: stream_manager became None
-                        # RuntimeError: stream_manager in inconsistent state
-                        rtsp_active = False
-                
                 if (self.camera is not None and 
                     not self.is_recording and 
-                    not rtsp_active and
+                    not self._is_rtsp_active() and
                     self.active_viewers == 0 and
                     self.last_access_time is not None):
                     idle_time = time.time() - self.last_access_time
                     if idle_time > self.idle_timeout:
-                        self.camera.release()
+                        # The grabber releases the device once it sees this
                         self.camera = None
                         self.last_access_time = None
+                    else:
+                        # Sleep until the timeout would expire, not a fixed tick
+                        wait_time = self.idle_timeout - idle_time + self.CLEANUP_WAKE_MARGIN
         
     def initialize(self):
-        """Initialize the camera."""
-        if self.camera is None:
+        """Initialize the camera.
+        
+        Safe to call from any thread on every frame request: the open camera
+        is detected without locking, and only callers that find it closed
+        contend for the lock that guards opening the device.
+        """
+        if self.camera is not None:
+            return
+        with self._init_lock:
+            if self.camera is not None:
+                return
+            # An RTSP stream capturing the device directly has to let go of
+            # it first; it is restarted below and then takes frames from us
+            direct_stream = self.stream_manager is not None and self.stream_manager.is_direct_capture()
+            if direct_stream:
+                self.stream_manager.stop_streaming()
             try:
-                self.camera = cv2.VideoCapture(self.config['CAMERA_INDEX'])
+                capture = cv2.VideoCapture(self.config['CAMERA_INDEX'])
                 
                 # Check if camera opened successfully
-                if not self.camera.isOpened():
+                if not capture.isOpened():
+                    capture.release()
                     self.camera_error = f"Camera Error\nCannot open camera at index {self.config['CAMERA_INDEX']}\nCheck device permissions and connections"
-                    self.camera = None
                     return
                 
-                self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.config['CAMERA_WIDTH'])
-                self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.config['CAMERA_HEIGHT'])
-                self.camera.set(cv2.CAP_PROP_FPS, self.config['CAMERA_FPS'])
+                # Ask the device for compressed frames first; the FOURCC
+                # determines which resolutions and frame rates USB can carry
+                if self.camera_fourcc:
+                    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.camera_fourcc))
+                capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.config['CAMERA_WIDTH'])
+                capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.config['CAMERA_HEIGHT'])
+                capture.set(cv2.CAP_PROP_FPS, self.config['CAMERA_FPS'])
+                # Keep the driver queue short so we never serve stale frames
+                capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
                 
                 # Clear any previous errors
                 self.camera_error = None
+                
+                # Publish the device only once it is fully configured so the
+                # unlocked check above never hands out a half-set-up capture
+                self.camera = capture
+                self._start_grab_thread(capture)
             except Exception as e:
                 self.camera_error = f"Camera Error\n{str(e)}\nCheck device permissions and connections"
                 self.camera = None
+            finally:
+                if direct_stream:
+                    self.stream_manager.start_streaming(self)
             
-    def get_frame(self):
-        """Get the current frame from the camera."""
-        # Update last access time (protected by lock to prevent race conditions)
-        with self.lock:
-            self.last_access_time = time.time()
+    def _start_grab_thread(self, capture):
+        """Start the background frame grabber for the given capture device."""
+        self._grab_thread = threading.Thread(
+            target=self._grab_worker,
+            args=(capture,),
+            daemon=True
+        )
+        self._grab_thread.start()
+    
+    def _grab_worker(self, capture):
+        """Background worker that continuously grabs frames from the camera.
+        
+        Every frame is grabbed to keep the driver queue drained, but it is
+        only decoded when something consumes it: recording, RTSP streaming,
+        or an MJPEG viewer whose CAMERA_STREAM_FPS interval has elapsed.
+        MJPEG frames are encoded here exactly once and shared by all viewers.
+        Only the most recent frame is kept. The worker exits and releases the
+        device as soon as ``self.camera`` no longer points at it.
+        
+        Args:
+            capture: cv2.VideoCapture instance owned by this worker
+        """
+        stream_interval = 1.0 / self.stream_fps
+        last_stream_time = 0.0
+        
+        try:
+            while self.camera is capture:
+                # The grabber owns the device, so reads need no lock and never
+                # block viewers, recording control, or the cleanup worker
+                stream_due = False
+                try:
+                    success = capture.grab()
+                    if success:
+                        now = time.monotonic()
+                        stream_due = self.active_viewers > 0 and now - last_stream_time >= stream_interval
+                        # Skip the decode entirely when nobody needs this frame
+                        if not (stream_due or self.is_recording or self._frame_queues):
+                            continue
+                        if stream_due:
+                            last_stream_time = now
+                        success, frame = capture.retrieve()
+                    if success:
+                        self._dispatch_frame(frame, stream_due)
+                    else:
+                        self.hub.publish(None)
+                except Exception as e:
+                    # Any failure, not only a read, is retried; an escaped
+                    # exception would leave the capture open but unread
+                    success = False
+                    self.camera_error = f"Camera Error\n{str(e)}\nCheck device permissions and connections"
+                    self.hub.publish(None)
+                
+                if not success:
+                    time.sleep(self.READ_RETRY_DELAY)
+        finally:
+            capture.release()
+            # If the worker died with the device still current, let
+            # initialize() open it again
+            with self.lock:
+                if self.camera is capture:
+                    self.camera = None
+            
+            # Wake viewers so they notice the camera went away
+            self.hub.publish(None)
+    
+    def _dispatch_frame(self, frame, stream_due: bool):
+        """Hand a decoded frame to the recording, the frame queues and viewers.
+        
+        Args:
+            frame: BGR frame returned by retrieve()
+            stream_due: Whether MJPEG viewers are due a new frame
+        """
+        # retrieve() allocates a fresh array per frame, so consumers
+        # get the reference itself; read-only guards that handoff
+        frame.flags.writeable = False
+        
+        # If recording, hand the frame to the writer thread. The queue
+        # reference is read without the lock: start/stop_recording
+        # publish or clear it with a single assignment.
+        write_queue = self._write_queue
+        if write_queue is not None:
+            try:
+                write_queue.put_nowait(frame)
+            except queue.Full:
+                self._dropped_frames += 1
+        
+        for frame_queue in self._frame_queues:
+            put_latest(frame_queue, frame)
+        
+        # Encode once for every connected viewer. imencode always returns
+        # a fresh buffer, so it is converted to bytes once per frame
+        # rather than once per viewer.
+        if stream_due:
+            # Viewers may get a downscaled copy; recording keeps full size
+            stream_frame = frame
+            if self.stream_scale != 1.0:
+                stream_frame = cv2.resize(
+                    frame, None,
+                    fx=self.stream_scale, fy=self.stream_scale,
+                    interpolation=cv2.INTER_AREA
+                )
+            ret, buffer = cv2.imencode('.jpg', stream_frame, self._jpeg_params)
+            if ret:
+                self.hub.publish(buffer.tobytes())
+        
+        # Clear error frame cache and error state since the frame went through
+        self.error_frame = None
+        self.camera_error = None
+    
+    def add_frame_queue(self, frame_queue: queue.Queue):
+        """Subscribe a queue to every decoded frame.
+        
+        The grabber never blocks on the queue: when it is full the oldest
+        frame is discarded, so a slow consumer always gets the freshest
+        frames. Frames are shared with other consumers and read-only.
+        
+        Args:
+            frame_queue: Bounded queue receiving BGR frames as numpy arrays
+        """
+        with self._frame_queues_lock:
+            self._frame_queues = self._frame_queues + (frame_queue,)
+    
+    def remove_frame_queue(self, frame_queue: queue.Queue):
+        """Unsubscribe a queue added with add_frame_queue().
+        
+        Args:
+            frame_queue: Queue to stop feeding
+        """
+        with self._frame_queues_lock:
+            self._frame_queues = tuple(q for q in self._frame_queues if q is not frame_queue)
+    
+    def get_frame(self, last_seq: int = 0) -> Tuple[Optional[bytes], int]:
+        """Get the latest shared JPEG frame from the camera.
+        
+        The JPEG is produced by the grabber thread and shared through the
+        broadcast hub; it is only encoded while viewers are registered via
+        add_viewer().
+        
+        Args:
+            last_seq: Sequence number of the frame the caller already has.
+                Waits until a newer frame is published.
+        
+        Returns:
+            Tuple of (JPEG-encoded bytes or error frame, sequence number).
+            The frame is None if nothing new was published in time.
+        """
+        # Update last access time (a single attribute store, no lock needed)
+        self.last_access_time = time.time()
         
         self.initialize()
         
+        seq = last_seq
+        if self.camera_error or self.camera is None:
+            # Pace error frames like real ones: wait for the grabber's next
+            # retry (or the timeout when no grabber runs) instead of handing
+            # the cached error frame back in a tight loop
+            jpeg, seq = self.hub.wait(last_seq, self.FRAME_WAIT_TIMEOUT)
+            if jpeg is not None and not self.camera_error:
+                # The camera recovered while we waited
+                return jpeg, seq
+        
         # If camera initialization failed or camera has an error, return error frame
         if self.camera_error:
             if self.error_frame is None:
                 self.error_frame = self.create_error_frame(self.camera_error)
             # If error frame creation failed, try to create a minimal fallback
             if self.error_frame is None:
-                return self.create_error_frame(self.FALLBACK_ERROR_MSG)
-            return self.error_frame
+                return self.create_error_frame(self.FALLBACK_ERROR_MSG), seq
+            return self.error_frame, seq
         
         # If camera is not available, return error frame
         if self.camera is None:
@@ -199,37 +552,20 @@ class Camera:
                 self.error_frame = self.create_error_frame(self.CAMERA_NOT_INIT_MSG)
             # If error frame creation failed, try to create a minimal fallback
             if self.error_frame is None:
-                return self.create_error_frame(self.FALLBACK_ERROR_MSG)
-            return self.error_frame
+                return self.create_error_frame(self.FALLBACK_ERROR_MSG), seq
+            return self.error_frame, seq
         
-        with self.lock:
-            try:
-                success, frame = self.camera.read()
-                if success:
-                    self.frame = frame.copy()
-                    
-                    # Clear error frame cache and error state since we got a successful read
-                    self.error_frame = None
-                    self.camera_error = None
-                    
-                    # If recording, write the frame
-                    if self.is_recording and self.video_writer is not None:
-                        self.video_writer.write(frame)
-                    
-                    # Encode frame to JPEG
-                    ret, buffer = cv2.imencode('.jpg', frame)
-                    if ret:
-                        return buffer.tobytes()
-                else:
-                    # Camera read failed, create error frame with caching
-                    return self._get_error_frame_with_fallback(self.CAMERA_READ_FAIL_MSG)
-            except Exception as e:
-                # Handle any other exceptions during frame reading
-                error_msg = f"Camera Error\n{str(e)}\nCheck device permissions and connections"
-                return self._get_error_frame_with_fallback(error_msg)
+        waited_seq = seq
+        jpeg, seq = self.hub.wait(waited_seq, self.FRAME_WAIT_TIMEOUT)
         
-        # Fallback: return a basic error frame
-        return self.create_error_frame(self.UNKNOWN_ERROR_MSG)
+        if seq == waited_seq:
+            # Nothing new yet (e.g. the camera is still warming up); the
+            # caller just waits again
+            return None, seq
+        if jpeg is None:
+            # Camera read failed, create error frame with caching
+            return self._get_error_frame_with_fallback(self.CAMERA_READ_FAIL_MSG), seq
+        return jpeg, seq
     
     def add_viewer(self):
         """Register a new viewer for the stream."""
@@ -240,6 +576,9 @@ class Camera:
         """Unregister a viewer from the stream."""
         with self.lock:
             self.active_viewers = max(0, self.active_viewers - 1)
+            if self.active_viewers == 0:
+                # Let the cleanup worker schedule the idle release right away
+                self.cleanup_wake_event.set()
     
     def set_stream_manager(self, stream_manager):
         """Set the stream manager for RTSP streaming.
@@ -253,11 +592,16 @@ class Camera:
         """Generator function for streaming frames."""
         self.add_viewer()
         try:
+            # Start from the current frame so a new viewer waits for a fresh one
+            seq = self.hub.seq
             while True:
-                frame = self.get_frame()
+                frame, seq = self.get_frame(seq)
                 if frame is not None:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+                    # Yield the JPEG as its own chunk so the (shared) frame
+                    # bytes are never copied into a concatenated part
+                    yield self.hub.part_header_for(frame)
+                    yield frame
+                    yield BroadcastHub.PART_FOOTER
         finally:
             self.remove_viewer()
     
@@ -277,18 +621,81 @@ class Camera:
             self.recording_filename = f'recording_{timestamp}.{self.config["VIDEO_FORMAT"]}'
             filepath = os.path.join(self.config['RECORDINGS_DIR'], self.recording_filename)
             
+            # Reuse the running RTSP encode for the file when the stream
+            # manager supports it, rather than encoding every frame twice
+            if self._is_rtsp_active() and self.stream_manager.start_recording(self, filepath):
+                self._recording_via_stream = True
+                self.is_recording = True
+                return self.recording_filename
+            
             # Initialize video writer
-            fourcc = cv2.VideoWriter_fourcc(*self.config['VIDEO_CODEC'])
-            self.video_writer = cv2.VideoWriter(
-                filepath,
-                fourcc,
-                self.config['CAMERA_FPS'],
-                (self.config['CAMERA_WIDTH'], self.config['CAMERA_HEIGHT'])
+            self.video_writer = self._create_video_writer(filepath)
+            
+            write_queue = queue.Queue(maxsize=self.RECORDING_QUEUE_SIZE)
+            self._dropped_frames = 0
+            self._writer_thread = threading.Thread(
+                target=self._writer_worker,
+                args=(self.video_writer, write_queue),
+                daemon=True
             )
+            self._writer_thread.start()
             
+            # Publishing the queue is what makes the grabber start feeding it
+            self._write_queue = write_queue
             self.is_recording = True
             return self.recording_filename
     
+    def _create_video_writer(self, filepath: str):
+        """Create the video writer for a new recording.
+        
+        With HW_ENCODE enabled the frames are encoded to H.264 by a GStreamer
+        hardware encoder; if that pipeline cannot be opened (for example the
+        OpenCV build lacks GStreamer) the software VIDEO_CODEC writer is used.
+        
+        Args:
+            filepath: Path of the recording file to create
+            
+        Returns:
+            cv2.VideoWriter instance
+        """
+        fps = self.config['CAMERA_FPS']
+        frame_size = (self.config['CAMERA_WIDTH'], self.config['CAMERA_HEIGHT'])
+        
+        if self.hw_encode:
+            muxer = self.GSTREAMER_MUXERS.get(self.config['VIDEO_FORMAT'], 'mp4mux')
+            # Quoted so a RECORDINGS_DIR with spaces still parses
+            location = filepath.replace('\\', '\\\\').replace('"', '\\"')
+            pipeline = (
+                f'appsrc ! videoconvert ! {self.hw_encoder} ! h264parse ! '
+                f'{muxer} ! filesink location="{location}"'
+            )
+            video_writer = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, fps, frame_size)
+            if video_writer.isOpened():
+                return video_writer
+            video_writer.release()
+            print(f"Warning: Hardware encoder {self.hw_encoder} unavailable, falling back to {self.config['VIDEO_CODEC']}")
+        
+        fourcc = cv2.VideoWriter_fourcc(*self.config['VIDEO_CODEC'])
+        return cv2.VideoWriter(filepath, fourcc, fps, frame_size)
+    
+    def _writer_worker(self, video_writer, write_queue):
+        """Background worker that writes queued frames to the recording.
+        
+        Args:
+            video_writer: cv2.VideoWriter for the current recording
+            write_queue: Queue of frames, terminated by None
+        """
+        try:
+            while True:
+                frame = write_queue.get()
+                if frame is None:
+                    break
+                video_writer.write(frame)
+        except Exception as e:
+            print(f"Warning: Recording writer failed: {e}")
+        finally:
+            video_writer.release()
+    
     def stop_recording(self) -> Optional[str]:
         """Stop recording video."""
         with self.lock:
@@ -297,13 +704,36 @@ class Camera:
             
             self.is_recording = False
             
-            if self.video_writer is not None:
-                self.video_writer.release()
-                self.video_writer = None
+            writer_thread = self._writer_thread
+            write_queue = self._write_queue
+            self._writer_thread = None
+            self._write_queue = None
+            self.video_writer = None
+            dropped_frames = self._dropped_frames
+            recording_via_stream = self._recording_via_stream
+            self._recording_via_stream = False
             
             filename = self.recording_filename
             self.recording_filename = None
-            return filename
+        
+        if recording_via_stream:
+            self.stream_manager.stop_recording()
+        # Drain outside the lock so capture continues while the file is finalized
+        if writer_thread is not None:
+            # A writer that died no longer drains the queue, so never block
+            # on the sentinel past the join timeout
+            if writer_thread.is_alive():
+                try:
+                    write_queue.put(None, timeout=self.WRITER_THREAD_JOIN_TIMEOUT)
+                except queue.Full:
+                    pass
+            writer_thread.join(timeout=self.WRITER_THREAD_JOIN_TIMEOUT)
+            if writer_thread.is_alive():
+                print(f"Warning: Recording writer did not finish within {self.WRITER_THREAD_JOIN_TIMEOUT}s")
+        if dropped_frames:
+            print(f"Warning: Dropped {dropped_frames} frames while recording {filename}")
+        
+        return filename
     
     def get_recording_status(self) -> dict:
         """Get current recording status."""
@@ -316,27 +746,39 @@ class Camera:
         """Release camera resources."""
         # Stop the cleanup thread
         self.cleanup_stop_event.set()
+        self.cleanup_wake_event.set()
         if self.cleanup_thread is not None and self.cleanup_thread.is_alive():
             self.cleanup_thread.join(timeout=self.CLEANUP_THREAD_JOIN_TIMEOUT)
             if self.cleanup_thread.is_alive():
                 # Thread didn't stop gracefully - this shouldn't happen but log if it does
                 print(f"Warning: Cleanup thread did not terminate within {self.CLEANUP_THREAD_JOIN_TIMEOUT}s")
         
+        self.stop_recording()
+        
         with self.lock:
-            if self.video_writer is not None:
-                self.video_writer.release()
-            if self.camera is not None:
-                self.camera.release()
             self.camera = None
+        
+        # The grabber releases the device once it sees the camera was cleared
+        if self._grab_thread is not None and self._grab_thread.is_alive():
+            self._grab_thread.join(timeout=self.CLEANUP_THREAD_JOIN_TIMEOUT)
 
 
 # Global camera instance
 camera_instance = None
+_camera_lock = threading.Lock()
 
 
 def get_camera(config):
-    """Get or create the global camera instance."""
+    """Get or create the global camera instance.
+    
+    Thread-safe: concurrent first calls create a single instance, while
+    later calls return it without taking the lock.
+    """
     global camera_instance
-    if camera_instance is None:
-        camera_instance = Camera(config)
-    return camera_instance
+    instance = camera_instance
+    if instance is None:
+        with _camera_lock:
+            if camera_instance is None:
+                camera_instance = Camera(config)
+            instance = camera_instance
+    return instance
@@ -0,0 +1,64 @@
+"""JSON provider that serializes responses with orjson."""
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+    
+    jsonify() and every other JSON response go through orjson's C encoder
+    instead of the stdlib json module. Output keeps Flask's defaults: sorted
+    keys, compact separators and indentation in debug mode. Types orjson
+    cannot handle natively fall back to Flask's default() conversion.
+    """
+    
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+    
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON to a string.
+        
+        Args:
+            obj: Data to serialize
+            **kwargs: json.dumps options; if given, the stdlib encoder is
+                used so they are honored
+        
+        Returns:
+            JSON string
+        """
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        """Deserialize JSON from a string or bytes.
+        
+        Args:
+            s: JSON text
+            **kwargs: json.loads options; if given, the stdlib decoder is
+                used so they are honored
+        
+        Returns:
+            Deserialized data
+        """
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        """Serialize the arguments as JSON and return a response.
+        
+        Args:
+            *args: A single value, or several values serialized as a list
+            **kwargs: Values serialized as a dict
+        
+        Returns:
+            Response with the JSON body as bytes
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.OPTIONS | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option),
+            mimetype=self.mimetype
+        )
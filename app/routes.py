@@ -1,7 +1,14 @@
 """Flask application routes."""
-from flask import Blueprint, render_template, Response, jsonify, current_app, send_from_directory
+from flask import Blueprint, render_template, Response, jsonify, send_from_directory, request
 import os
 import logging
+import threading
+import hashlib
+import mimetypes
+import unicodedata
+from urllib.parse import quote
+from operator import itemgetter
+import orjson
 
 # Create blueprint for main routes
 main_bp = Blueprint('main', __name__)
@@ -9,6 +16,192 @@ main_bp = Blueprint('main', __name__)
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Extensions (without the dot) served as recordings
+VIDEO_EXTENSIONS = frozenset(('mp4', 'avi', 'mov'))
+
+# Shared objects bound once at app initialization, see init_routes()
+_camera = None
+_stream_manager = None
+_recordings_dir = None
+_accel_redirect_prefix = None
+
+# Scanned /api/recordings listing and its serialized response, reused until
+# the directory's mtime changes
+_listing_cache = {'key': None, 'files': None, 'payload': None, 'etag': None, 'lock': threading.Lock()}
+
+
+def init_routes(camera, stream_manager, recordings_dir, accel_redirect_prefix=None):
+    """Bind the objects used by the routes.
+    
+    Handlers read these module globals instead of going through the
+    current_app proxy and config lookups on every request.
+    
+    Args:
+        camera: Camera instance shared by all requests
+        stream_manager: StreamManager instance, or None if RTSP is disabled
+        recordings_dir: Directory holding the recordings
+        accel_redirect_prefix: nginx internal location for downloads
+            (X_ACCEL_REDIRECT_PREFIX), or None/empty to serve them directly
+    """
+    global _camera, _stream_manager, _recordings_dir, _accel_redirect_prefix
+    _camera = camera
+    _stream_manager = stream_manager
+    _recordings_dir = recordings_dir
+    _accel_redirect_prefix = accel_redirect_prefix.rstrip('/') if accel_redirect_prefix else None
+
+
+def _is_video_file(filename):
+    """Check whether a filename has one of the recording extensions."""
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension in VIDEO_EXTENSIONS
+
+
+def _recording_path(recordings_dir, filename):
+    """Resolve a requested recording name to a path inside the recordings directory.
+    
+    Args:
+        recordings_dir: Directory holding the recordings
+        filename: File name taken from the URL
+        
+    Returns:
+        Path of the directory entry itself (a symlink is not followed), or
+        None if the name is unsafe or resolves (e.g. through a symlink)
+        outside the recordings directory
+    """
+    # Only plain names are accepted: no path separators, NUL bytes or
+    # directory references. Spaces and non-ASCII names are fine, since the
+    # listing offers every file in the directory.
+    if (not filename or filename in ('.', '..') or '\0' in filename
+            or os.sep in filename or (os.altsep and os.altsep in filename)):
+        return None
+    base = os.path.realpath(recordings_dir)
+    filepath = os.path.join(base, filename)
+    # The resolved path is only used for containment; callers act on the
+    # entry itself, so deleting a symlink removes the link, not its target
+    if os.path.dirname(os.path.realpath(filepath)) != base:
+        return None
+    return filepath
+
+
+def _find_recording(recordings_dir, filename):
+    """Validate a requested recording and locate it.
+    
+    Args:
+        recordings_dir: Directory holding the recordings
+        filename: File name taken from the URL
+        
+    Returns:
+        Tuple of (path, None) for an existing recording, or (None, error
+        response) if the name is invalid or the file does not exist
+    """
+    # Security check: prevent directory traversal
+    filepath = _recording_path(recordings_dir, filename)
+    if filepath is None:
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'Invalid filename'
+        }), 400)
+    
+    if not _is_video_file(filename):
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'Invalid file type'
+        }), 400)
+    
+    if not os.path.isfile(filepath):
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'File not found'
+        }), 404)
+    
+    return filepath, None
+
+
+def _scan_recordings(recordings_dir):
+    """Collect the metadata of every recording, newest first.
+    
+    Args:
+        recordings_dir: Directory holding the recordings
+        
+    Returns:
+        List of dicts with filename, size and created keys
+    """
+    # scandir caches one stat() per entry instead of separate size/ctime
+    # lookups; is_file() is answered from the directory listing itself and
+    # skips anything that is not a regular file (e.g. a "clips.mp4" folder)
+    files = []
+    with os.scandir(recordings_dir) as entries:
+        for entry in entries:
+            if _is_video_file(entry.name) and entry.is_file():
+                stat = entry.stat()
+                files.append({
+                    'filename': entry.name,
+                    'size': stat.st_size,
+                    'created': stat.st_ctime
+                })
+    
+    # Sort by creation time, newest first
+    files.sort(key=itemgetter('created'), reverse=True)
+    return files
+
+
+def _invalidate_listing_cache():
+    """Force the next /api/recordings request to rescan the directory."""
+    with _listing_cache['lock']:
+        _listing_cache['key'] = None
+
+
+def _attachment_params(filename):
+    """Build Content-Disposition parameters for a download, as send_file() does.
+    
+    Header values must be Latin-1, so a non-ASCII name is sent as an ASCII
+    approximation in filename= plus the exact name in an RFC 5987
+    filename*= parameter.
+    
+    Args:
+        filename: Name the browser should save the file as
+        
+    Returns:
+        Dict of parameters for headers.set('Content-Disposition', ...)
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': "UTF-8''" + quote(filename, safe="!#$&+^`|~")}
+    return {'filename': filename}
+
+
+def _listing_etag(payload):
+    """Compute the ETag of a serialized recordings listing."""
+    return hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+def _listing_response(payload, etag):
+    """Build the /api/recordings response, or a 304 if the client has it.
+    
+    Args:
+        payload: Serialized JSON listing
+        etag: ETag of the payload
+        
+    Returns:
+        Response object
+    """
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    # Polling clients revalidate every time and get an empty 304 when the
+    # listing is unchanged
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _current_size(recordings_dir, entry):
+    """Re-read the size of a listed recording, keeping the cached one if it vanished."""
+    try:
+        return os.stat(os.path.join(recordings_dir, entry['filename'])).st_size
+    except OSError:
+        return entry['size']
+
 
 @main_bp.route('/')
 def index():
@@ -19,29 +212,32 @@ def index():
 @main_bp.route('/video_feed')
 def video_feed():
     """Video streaming route."""
-    camera = current_app.config['camera']
-    return Response(
-        camera.generate_frames(),
-        mimetype='multipart/x-mixed-replace; boundary=frame'
+    # Hand frames straight to the WSGI server and keep proxies (nginx)
+    # and browsers from buffering or caching the endless stream
+    response = Response(
+        _camera.generate_frames(),
+        mimetype='multipart/x-mixed-replace; boundary=frame',
+        direct_passthrough=True
     )
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 @main_bp.route('/api/stream/rtsp/start', methods=['POST'])
 def start_rtsp_stream():
     """Start RTSP streaming endpoint."""
-    stream_manager = current_app.config.get('stream_manager')
-    if not stream_manager:
+    if not _stream_manager:
         return jsonify({
             'status': 'error',
             'message': 'RTSP streaming is not enabled'
         }), 400
     
-    camera = current_app.config['camera']
-    if stream_manager.start_streaming(camera):
+    if _stream_manager.start_streaming(_camera):
         return jsonify({
             'status': 'success',
             'message': 'RTSP streaming started',
-            'rtsp_url': stream_manager.get_rtsp_url()
+            'rtsp_url': _stream_manager.get_rtsp_url()
         })
     else:
         return jsonify({
@@ -53,14 +249,13 @@ def start_rtsp_stream():
 @main_bp.route('/api/stream/rtsp/stop', methods=['POST'])
 def stop_rtsp_stream():
     """Stop RTSP streaming endpoint."""
-    stream_manager = current_app.config.get('stream_manager')
-    if not stream_manager:
+    if not _stream_manager:
         return jsonify({
             'status': 'error',
             'message': 'RTSP streaming is not enabled'
         }), 400
     
-    stream_manager.stop_streaming()
+    _stream_manager.stop_streaming()
     return jsonify({
         'status': 'success',
         'message': 'RTSP streaming stopped'
@@ -70,8 +265,7 @@ def stop_rtsp_stream():
 @main_bp.route('/api/stream/rtsp/status', methods=['GET'])
 def rtsp_stream_status():
     """Get RTSP streaming status endpoint."""
-    stream_manager = current_app.config.get('stream_manager')
-    if not stream_manager:
+    if not _stream_manager:
         return jsonify({
             'enabled': False,
             'active': False
@@ -79,16 +273,15 @@ def rtsp_stream_status():
     
     return jsonify({
         'enabled': True,
-        'active': stream_manager.is_active(),
-        'rtsp_url': stream_manager.get_rtsp_url() if stream_manager.is_active() else None
+        'active': _stream_manager.is_active(),
+        'rtsp_url': _stream_manager.get_rtsp_url() if _stream_manager.is_active() else None
     })
 
 
 @main_bp.route('/api/recording/start', methods=['POST'])
 def start_recording():
     """Start recording endpoint."""
-    camera = current_app.config['camera']
-    filename = camera.start_recording()
+    filename = _camera.start_recording()
     if filename:
         return jsonify({
             'status': 'success',
@@ -105,9 +298,11 @@ def start_recording():
 @main_bp.route('/api/recording/stop', methods=['POST'])
 def stop_recording():
     """Stop recording endpoint."""
-    camera = current_app.config['camera']
-    filename = camera.stop_recording()
+    filename = _camera.stop_recording()
     if filename:
+        # The finished file's final size is not reflected in the directory
+        # mtime, so drop the listing scanned while it was still growing
+        _invalidate_listing_cache()
         return jsonify({
             'status': 'success',
             'message': 'Recording stopped',
@@ -123,10 +318,7 @@ def stop_recording():
 @main_bp.route('/api/status', methods=['GET'])
 def get_status():
     """Get combined system status (recording and RTSP)."""
-    camera = current_app.config['camera']
-    stream_manager = current_app.config.get('stream_manager')
-    
-    recording_status = camera.get_recording_status()
+    recording_status = _camera.get_recording_status()
     
     rtsp_status = {
         'enabled': False,
@@ -134,11 +326,11 @@ def get_status():
         'rtsp_url': None
     }
     
-    if stream_manager:
+    if _stream_manager:
         rtsp_status = {
             'enabled': True,
-            'active': stream_manager.is_active(),
-            'rtsp_url': stream_manager.get_rtsp_url() if stream_manager.is_active() else None
+            'active': _stream_manager.is_active(),
+            'rtsp_url': _stream_manager.get_rtsp_url() if _stream_manager.is_active() else None
         }
     
     return jsonify({
@@ -150,92 +342,90 @@ def get_status():
 @main_bp.route('/api/recording/status', methods=['GET'])
 def recording_status():
     """Get recording status endpoint."""
-    camera = current_app.config['camera']
-    status = camera.get_recording_status()
+    status = _camera.get_recording_status()
     return jsonify(status)
 
 
 @main_bp.route('/api/recordings', methods=['GET'])
 def list_recordings():
     """List all recordings."""
-    recordings_dir = current_app.config['RECORDINGS_DIR']
-    if not os.path.exists(recordings_dir):
+    recordings_dir = _recordings_dir
+    try:
+        mtime = os.stat(recordings_dir).st_mtime_ns
+    except FileNotFoundError:
         return jsonify({'recordings': []})
     
-    files = []
-    for filename in os.listdir(recordings_dir):
-        if filename.endswith(('.mp4', '.avi', '.mov')):
-            filepath = os.path.join(recordings_dir, filename)
-            files.append({
-                'filename': filename,
-                'size': os.path.getsize(filepath),
-                'created': os.path.getctime(filepath)
-            })
+    cache_key = (recordings_dir, mtime)
+    with _listing_cache['lock']:
+        if _listing_cache['key'] == cache_key:
+            files = _listing_cache['files']
+            payload = _listing_cache['payload']
+            etag = _listing_cache['etag']
+        else:
+            files = payload = etag = None
     
-    # Sort by creation time, newest first
-    files.sort(key=lambda x: x['created'], reverse=True)
+    if files is None:
+        files = _scan_recordings(recordings_dir)
+        with _listing_cache['lock']:
+            _listing_cache['key'] = cache_key
+            _listing_cache['files'] = files
+            _listing_cache['payload'] = payload
+            _listing_cache['etag'] = etag
+    
+    # A recording in progress grows without touching the directory mtime,
+    # so the cached listing is reused with just that file's size refreshed
+    status = _camera.get_recording_status()
+    if status['is_recording'] and status['filename']:
+        files = [
+            dict(entry, size=_current_size(recordings_dir, entry))
+            if entry['filename'] == status['filename'] else entry
+            for entry in files
+        ]
+        payload = orjson.dumps({'recordings': files})
+        return _listing_response(payload, _listing_etag(payload))
     
-    return jsonify({'recordings': files})
+    if payload is None:
+        # orjson serializes large listings far faster than the stdlib encoder
+        payload = orjson.dumps({'recordings': files})
+        etag = _listing_etag(payload)
+        with _listing_cache['lock']:
+            if _listing_cache['key'] == cache_key:
+                _listing_cache['payload'] = payload
+                _listing_cache['etag'] = etag
+    
+    return _listing_response(payload, etag)
 
 
 @main_bp.route('/api/recordings/<filename>', methods=['GET'])
 def download_recording(filename):
     """Download a specific recording."""
-    recordings_dir = current_app.config['RECORDINGS_DIR']
+    recordings_dir = _recordings_dir
+    filepath, error = _find_recording(recordings_dir, filename)
+    if error:
+        return error
     
-    # Security check: prevent directory traversal
-    if '..' in filename or '/' in filename or '\\' in filename:
-        return jsonify({
-            'status': 'error',
-            'message': 'Invalid filename'
-        }), 400
+    # Behind nginx, hand the transfer to the front-end server so the file
+    # is sent with sendfile(2) instead of being read through Python
+    if _accel_redirect_prefix:
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = _accel_redirect_prefix + '/' + quote(filename)
+        response.headers.set('Content-Disposition', 'attachment', **_attachment_params(filename))
+        return response
     
-    # Check if file exists and is a valid video file
-    if not filename.endswith(('.mp4', '.avi', '.mov')):
-        return jsonify({
-            'status': 'error',
-            'message': 'Invalid file type'
-        }), 400
-    
-    filepath = os.path.join(recordings_dir, filename)
-    if not os.path.exists(filepath):
-        return jsonify({
-            'status': 'error',
-            'message': 'File not found'
-        }), 404
-    
-    return send_from_directory(recordings_dir, filename, as_attachment=True)
+    # Honors USE_X_SENDFILE and answers Range/If-Modified-Since requests
+    return send_from_directory(recordings_dir, filename, as_attachment=True, conditional=True)
 
 
 @main_bp.route('/api/recordings/<filename>', methods=['DELETE'])
 def delete_recording(filename):
     """Delete a specific recording."""
-    recordings_dir = current_app.config['RECORDINGS_DIR']
-    
-    # Security check: prevent directory traversal
-    if '..' in filename or '/' in filename or '\\' in filename:
-        return jsonify({
-            'status': 'error',
-            'message': 'Invalid filename'
-        }), 400
-    
-    # Check if file is a valid video file
-    if not filename.endswith(('.mp4', '.avi', '.mov')):
-        return jsonify({
-            'status': 'error',
-            'message': 'Invalid file type'
-        }), 400
-    
-    filepath = os.path.join(recordings_dir, filename)
-    if not os.path.exists(filepath):
-        return jsonify({
-            'status': 'error',
-            'message': 'File not found'
-        }), 404
+    recordings_dir = _recordings_dir
+    filepath, error = _find_recording(recordings_dir, filename)
+    if error:
+        return error
     
     # Check if file is currently being recorded
-    camera = current_app.config['camera']
-    status = camera.get_recording_status()
+    status = _camera.get_recording_status()
     if status['is_recording'] and status['filename']:
         # Normalize both filenames for comparison
         try:
@@ -3,8 +3,13 @@ import subprocess
 import threading
 import time
 import logging
+import os
+import select
+import queue
 from typing import Optional
 import numpy as np
+import cv2
+from app.camera import put_latest
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +17,35 @@ logger = logging.getLogger(__name__)
 class StreamManager:
     """Manages streaming to RTSP server using FFMPEG."""
     
+    # Render node used by the VAAPI and QuickSync encoders
+    VAAPI_DEVICE = '/dev/dri/renderD128'
+    # FFMPEG arguments per H.264 encoder, as (before -i, after -i)
+    ENCODER_ARGS = {
+        'h264_nvenc': ([], ['-c:v', 'h264_nvenc', '-preset', 'p1', '-tune', 'll', '-zerolatency', '1']),
+        'h264_vaapi': (['-vaapi_device', VAAPI_DEVICE], ['-vf', 'format=nv12,hwupload', '-c:v', 'h264_vaapi']),
+        'h264_qsv': ([], ['-c:v', 'h264_qsv', '-preset', 'veryfast']),
+        'libx264': ([], ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency']),
+    }
+    # Hardware encoders tried in order when RTSP_ENCODER is 'auto', with the
+    # device node each one needs inside the container
+    HW_ENCODER_DEVICES = (
+        ('h264_nvenc', '/dev/nvidiactl'),
+        ('h264_vaapi', VAAPI_DEVICE),
+        ('h264_qsv', VAAPI_DEVICE),
+    )
+    FALLBACK_ENCODER = 'libx264'
+    ENCODER_PROBE_TIMEOUT = 10
+    # Only report errors, without the per-second progress line
+    FFMPEG_LOG_ARGS = ('-hide_banner', '-loglevel', 'error', '-nostats')
+    # Frames buffered between the camera and FFMPEG; older ones are dropped
+    FRAME_QUEUE_SIZE = 2
+    # Seconds without frames before the worker makes sure the camera is open
+    FRAME_WAIT_TIMEOUT = 1.0
+    # Seconds to wait for FFMPEG to drain its stdin before checking for shutdown
+    PIPE_WAIT_INTERVAL = 0.1
+    # Seconds between reports of frames dropped because FFMPEG fell behind
+    DROP_LOG_INTERVAL = 10
+    
     def __init__(self, config):
         """Initialize stream manager."""
         self.config = config
@@ -26,6 +60,22 @@ class StreamManager:
         self.width = self._get_config('CAMERA_WIDTH', 640)
         self.height = self._get_config('CAMERA_HEIGHT', 480)
         self.fps = self._get_config('CAMERA_FPS', 30)
+        self.encoder = self._select_encoder(self._get_config('RTSP_ENCODER', 'auto'))
+        
+        # Let FFMPEG read the webcam itself while nothing else has it open
+        self.direct_capture = self._get_config('RTSP_DIRECT_CAPTURE', False)
+        self.device = f"/dev/video{self._get_config('CAMERA_INDEX', 0)}"
+        self.camera_fourcc = self._get_config('CAMERA_FOURCC', 'MJPG')
+        self._direct = False
+        
+        # Record through the RTSP encode (tee muxer) instead of a second
+        # encode in the camera while streaming is active
+        self.tee_recording = self._get_config('RTSP_TEE_RECORDING', False)
+        self.recording_path = None
+        self._camera = None
+        self._frame_queue = None
+        
+        self._configure_ffmpeg()
     
     def _get_config(self, key, default=None):
         """Get configuration value, handling both dict and object configs.
@@ -41,6 +91,81 @@ class StreamManager:
             return self.config.get(key, default)
         else:
             return getattr(self.config, key, default)
+    
+    def _select_encoder(self, requested):
+        """Pick the H.264 encoder FFMPEG uses for the RTSP stream.
+        
+        Args:
+            requested: Encoder name from ENCODER_ARGS, or 'auto' to prefer a
+                hardware encoder that FFMPEG was built with, whose device is
+                present and that passes a trial encode, falling back to
+                libx264
+            
+        Returns:
+            Encoder name (a key of ENCODER_ARGS)
+        """
+        if requested != 'auto':
+            if requested in self.ENCODER_ARGS:
+                return requested
+            logger.warning(f"Unknown RTSP encoder '{requested}', using {self.FALLBACK_ENCODER}")
+            return self.FALLBACK_ENCODER
+        
+        try:
+            result = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-encoders'],
+                capture_output=True,
+                text=True,
+                timeout=self.ENCODER_PROBE_TIMEOUT
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not probe FFMPEG encoders: {e}")
+            return self.FALLBACK_ENCODER
+        
+        # Encoder lines look like " V....D h264_nvenc  NVIDIA NVENC H.264 encoder"
+        available = {fields[1] for fields in map(str.split, result.stdout.splitlines()) if len(fields) > 1}
+        for encoder, device in self.HW_ENCODER_DEVICES:
+            if encoder in available and os.path.exists(device) and self._encoder_works(encoder):
+                logger.info(f"Using hardware encoder {encoder} for RTSP streaming")
+                return encoder
+        return self.FALLBACK_ENCODER
+    
+    def _encoder_works(self, encoder):
+        """Check that FFMPEG can actually encode with an encoder.
+        
+        Being listed by ``ffmpeg -encoders`` and having a device node does not
+        mean the driver supports H.264 encoding, so a single synthetic frame
+        at the stream resolution is encoded as a trial.
+        
+        Args:
+            encoder: Encoder name (a key of ENCODER_ARGS)
+            
+        Returns:
+            True if the trial encode succeeded
+        """
+        input_args, output_args = self.ENCODER_ARGS[encoder]
+        cmd = [
+            'ffmpeg', *self.FFMPEG_LOG_ARGS,
+            *input_args,
+            '-f', 'lavfi', '-i', f'nullsrc=s={self.width}x{self.height}',
+            '-frames:v', '1',
+            *output_args,
+            '-f', 'null', '-'
+        ]
+        try:
+            result = subprocess.run(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=self.ENCODER_PROBE_TIMEOUT
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.info(f"Trial encode with {encoder} failed: {e}")
+            return False
+        if result.returncode != 0:
+            logger.info(f"Trial encode with {encoder} failed: {result.stderr.strip()}")
+            return False
+        return True
         
     def start_streaming(self, camera):
         """Start streaming to RTSP server.
@@ -53,99 +178,332 @@ class StreamManager:
                 logger.info("Streaming already active")
                 return True
             
+            if self.recording_path:
+                # FFMPEG kept publishing for the recording after the stream
+                # was stopped; just claim it again
+                self.is_streaming = True
+                return True
+            
             try:
-                # Build FFMPEG command to receive raw video and stream to RTSP
-                ffmpeg_cmd = [
-                    'ffmpeg',
-                    '-y',  # Overwrite output
-                    '-f', 'rawvideo',
-                    '-vcodec', 'rawvideo',
-                    '-pix_fmt', 'bgr24',
-                    '-s', f'{self.width}x{self.height}',
-                    '-r', str(self.fps),
-                    '-i', '-',  # Read from stdin
-                    '-c:v', 'libx264',
-                    '-preset', 'ultrafast',
-                    '-tune', 'zerolatency',
-                    '-f', 'rtsp',
-                    self.rtsp_url
-                ]
-                
-                logger.info(f"Starting FFMPEG stream to {self.rtsp_url}")
-                self.ffmpeg_process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    bufsize=10**8
-                )
-                
+                self._camera = camera
+                self._launch_ffmpeg(camera)
                 self.is_streaming = True
-                self.stop_event.clear()
-                
-                # Start thread to feed frames to FFMPEG
-                self.stream_thread = threading.Thread(
-                    target=self._stream_worker,
-                    args=(camera,),
-                    daemon=True
-                )
-                self.stream_thread.start()
-                
                 logger.info("RTSP streaming started successfully")
                 return True
                 
             except Exception as e:
                 logger.error(f"Failed to start RTSP streaming: {e}")
                 self.is_streaming = False
-                if self.ffmpeg_process:
-                    self.ffmpeg_process.terminate()
-                    self.ffmpeg_process = None
+                self._terminate_ffmpeg()
                 return False
     
-    def _stream_worker(self, camera):
+    def start_recording(self, camera, filepath):
+        """Record to a file from the running RTSP encode.
+        
+        FFMPEG is restarted with a tee muxer that writes the H.264 stream to
+        both the RTSP server and the recording, so the frames are encoded
+        once instead of again by the camera's VideoWriter.
+        
+        Args:
+            camera: Camera instance to stream from
+            filepath: Path of the recording file to create
+            
+        Returns:
+            True if FFMPEG is now recording, False if the caller should
+            record by itself
+        """
+        with self.lock:
+            if not (self.tee_recording and self.is_streaming) or self.recording_path:
+                return False
+            
+            self._terminate_ffmpeg()
+            self.recording_path = filepath
+            try:
+                self._launch_ffmpeg(camera)
+                logger.info(f"Recording {filepath} from the RTSP stream")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to record from the RTSP stream: {e}")
+                self.recording_path = None
+                self._terminate_ffmpeg()
+                self._relaunch_streaming()
+                return False
+    
+    def stop_recording(self):
+        """Stop a recording made by start_recording().
+        
+        FFMPEG is stopped so the file is finalized, then restarted for RTSP
+        alone if streaming is still wanted.
+        """
+        with self.lock:
+            if not self.recording_path:
+                return
+            
+            self.recording_path = None
+            self._terminate_ffmpeg()
+            self._relaunch_streaming()
+    
+    def _relaunch_streaming(self):
+        """Restart FFMPEG for RTSP only after its outputs changed."""
+        if not self.is_streaming:
+            return
+        try:
+            self._launch_ffmpeg(self._camera)
+        except Exception as e:
+            logger.error(f"Failed to restart RTSP streaming: {e}")
+            self.is_streaming = False
+            self._terminate_ffmpeg()
+    
+    def _launch_ffmpeg(self, camera):
+        """Start FFMPEG and, when it reads from stdin, the frame feeder thread.
+        
+        Args:
+            camera: Camera instance to stream from
+        """
+        # Capture straight from V4L2 when the camera is idle, so frames
+        # never pass through Python; otherwise pipe in the camera's frames
+        direct = self.direct_capture and camera.camera is None and not self.recording_path
+        ffmpeg_cmd = self._build_ffmpeg_cmd(direct)
+        
+        logger.info(f"Starting FFMPEG stream to {self.rtsp_url}"
+                    + (f" directly from {self.device}" if direct else ""))
+        # Unbuffered stdin: each frame goes from the numpy array
+        # straight into the pipe instead of first being copied into
+        # (and held back by) a Python-side write buffer
+        self.ffmpeg_process = subprocess.Popen(
+            ffmpeg_cmd,
+            stdin=subprocess.DEVNULL if direct else subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            bufsize=0
+        )
+        # Drain stderr continuously: an unread pipe fills up and stalls FFMPEG
+        threading.Thread(
+            target=self._log_ffmpeg_output,
+            args=(self.ffmpeg_process.stderr,),
+            daemon=True
+        ).start()
+        self._direct = direct
+        self.stop_event.clear()
+        
+        # Start thread to feed frames to FFMPEG
+        if not direct:
+            # Non-blocking so a stalled FFMPEG (e.g. an RTSP hiccup) costs
+            # dropped frames instead of a worker stuck in write()
+            os.set_blocking(self.ffmpeg_process.stdin.fileno(), False)
+            self._frame_queue = queue.Queue(maxsize=self.FRAME_QUEUE_SIZE)
+            camera.add_frame_queue(self._frame_queue)
+            self.stream_thread = threading.Thread(
+                target=self._stream_worker,
+                args=(camera, self._frame_queue, self.ffmpeg_process.stdin, self._frame_buf, 1.0 / self.fps),
+                daemon=True
+            )
+            self.stream_thread.start()
+    
+    def _configure_ffmpeg(self):
+        """Precompute the parts of the FFMPEG command that only depend on settings.
+        
+        Called once at construction and again by reconfigure(); starting a
+        stream then only has to pick an input and append its outputs.
+        """
+        input_args, codec_args = self.ENCODER_ARGS[self.encoder]
+        size = f'{self.width}x{self.height}'
+        
+        # Raw BGR frames written to stdin by the stream worker
+        self._pipe_cmd = (
+            'ffmpeg',
+            *self.FFMPEG_LOG_ARGS,
+            '-y',  # Overwrite output
+            *input_args,
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', size,
+            '-r', str(self.fps),
+            '-i', '-',  # Read from stdin
+            *codec_args
+        )
+        
+        # The webcam device read by FFMPEG itself
+        input_format = ('-input_format', 'mjpeg') if self.camera_fourcc == 'MJPG' else ()
+        self._direct_cmd = (
+            'ffmpeg',
+            *self.FFMPEG_LOG_ARGS,
+            '-y',  # Overwrite output
+            *input_args,
+            '-f', 'v4l2',
+            *input_format,
+            '-video_size', size,
+            '-framerate', str(self.fps),
+            '-i', self.device,
+            *codec_args
+        )
+        
+        # Frames that already match the size ffmpeg expects are written as-is;
+        # this buffer only receives the ones the device delivered at
+        # another resolution
+        self._frame_buf = np.empty((self.height, self.width, 3), dtype=np.uint8)
+    
+    def reconfigure(self, width=None, height=None, fps=None):
+        """Change the RTSP stream's resolution or frame rate.
+        
+        A running stream is restarted with the new settings. While FFMPEG is
+        also writing a recording, the change is applied the next time it
+        starts so the file is not cut short.
+        
+        Args:
+            width: New frame width in pixels, or None to keep the current one
+            height: New frame height in pixels, or None to keep the current one
+            fps: New frame rate, or None to keep the current one
+        """
+        with self.lock:
+            restart = self.ffmpeg_process is not None and not self.recording_path
+            if restart:
+                self._terminate_ffmpeg()
+            
+            if width is not None:
+                self.width = width
+            if height is not None:
+                self.height = height
+            if fps is not None:
+                self.fps = fps
+            self._configure_ffmpeg()
+            
+            if restart:
+                self._relaunch_streaming()
+    
+    def _build_ffmpeg_cmd(self, direct):
+        """Build the FFMPEG command line for the RTSP stream.
+        
+        Args:
+            direct: Read the webcam device with FFMPEG's v4l2 input instead
+                of raw BGR frames from stdin
+            
+        Returns:
+            FFMPEG argument list
+        """
+        if self.recording_path:
+            # One encode feeding both outputs; RTSP failures (e.g. the server
+            # restarting) must not end the recording
+            extension = self.recording_path.rpartition('.')[2]
+            output_args = (
+                '-map', '0:v',
+                '-f', 'tee',
+                f'[f=rtsp:onfail=ignore]{self.rtsp_url}|[f={extension}]{self.recording_path}'
+            )
+        else:
+            output_args = ('-f', 'rtsp', self.rtsp_url)
+        return [*(self._direct_cmd if direct else self._pipe_cmd), *output_args]
+    
+    def _stream_worker(self, camera, frame_queue, stdin, frame_buf, frame_interval):
         """Worker thread that feeds frames to FFMPEG.
         
         Args:
-            camera: Camera instance to get frames from
+            camera: Camera instance the frames come from
+            frame_queue: Queue the camera's grabber thread fills with frames,
+                terminated by None
+            stdin: Stdin pipe of the FFMPEG process this worker feeds
+            frame_buf: Buffer with the frame size this FFMPEG process
+                expects, for resizing frames that do not match it
+            frame_interval: Seconds between frames at the frame rate this
+                FFMPEG process expects; faster cameras are thinned to it
         """
-        frame_interval = 1.0 / self.fps
+        dropped_frames = 0
+        last_drop_report = time.monotonic()
+        next_frame_time = 0.0
+        camera.initialize()
         
-        while not self.stop_event.is_set() and self.is_streaming:
+        while not self.stop_event.is_set():
             try:
-                # Get frame from camera (this is the raw numpy array)
-                with camera.lock:
-                    if camera.camera is None:
-                        camera.initialize()
-                    
-                    if camera.camera is not None:
-                        success, frame = camera.camera.read()
-                        if success and frame is not None:
-                            # Write raw frame to FFMPEG stdin
-                            try:
-                                if self.ffmpeg_process.stdin:
-                                    self.ffmpeg_process.stdin.write(frame.tobytes())
-                                else:
-                                    logger.error("FFMPEG stdin is None")
-                                    break
-                            except (BrokenPipeError, IOError, AttributeError) as e:
-                                logger.error(f"FFMPEG pipe error: {e}")
-                                break
-                        else:
-                            # Camera read failed, wait a bit
-                            time.sleep(0.1)
-                    else:
-                        # Camera not initialized, wait
-                        time.sleep(0.1)
+                # Block until the grabber delivers a frame, which paces this
+                # loop at the device frame rate
+                try:
+                    frame = frame_queue.get(timeout=self.FRAME_WAIT_TIMEOUT)
+                except queue.Empty:
+                    # No frames: the camera is closed or failing, so (re)open it
+                    camera.initialize()
+                    continue
+                if frame is None:
+                    break
+                
+                # Skip frames arriving well ahead of schedule; the half
+                # interval of slack absorbs jitter at matching rates
+                now = time.monotonic()
+                if now < next_frame_time - frame_interval / 2:
+                    continue
+                next_frame_time = max(next_frame_time + frame_interval, now)
+                
+                if frame.shape != frame_buf.shape:
+                    frame = cv2.resize(frame, (frame_buf.shape[1], frame_buf.shape[0]), dst=frame_buf)
+                # Write raw frame to FFMPEG stdin
+                try:
+                    if not self._write_frame(stdin, frame):
+                        dropped_frames += 1
+                except (BrokenPipeError, IOError, ValueError) as e:
+                    # ValueError: stdin was closed while FFMPEG restarted
+                    logger.error(f"FFMPEG pipe error: {e}")
+                    break
                 
-                # Sleep to maintain frame rate
-                time.sleep(frame_interval)
+                now = time.monotonic()
+                if now - last_drop_report >= self.DROP_LOG_INTERVAL:
+                    if dropped_frames:
+                        logger.warning(f"Dropped {dropped_frames} frames in the last "
+                                       f"{now - last_drop_report:.0f}s, FFMPEG is not keeping up")
+                    dropped_frames = 0
+                    last_drop_report = now
                 
             except Exception as e:
                 logger.error(f"Error in stream worker: {e}")
-                time.sleep(0.1)
         
         logger.info("Stream worker stopped")
     
+    def _log_ffmpeg_output(self, stderr):
+        """Forward FFMPEG's error output to the log until the process exits.
+        
+        Args:
+            stderr: Stderr pipe of the FFMPEG process
+        """
+        with stderr:
+            for line in stderr:
+                line = line.decode(errors='replace').rstrip()
+                if line:
+                    logger.error(f"FFMPEG: {line}")
+    
+    def _write_frame(self, stdin, frame):
+        """Write one raw frame to FFMPEG's non-blocking stdin.
+        
+        The frame is passed as a memoryview so its pixels are not copied into
+        an intermediate bytes object. A frame is dropped if the pipe is full
+        when it arrives; once started it is always finished, since a partly
+        written frame would shift every following one in the raw stream.
+        
+        Args:
+            stdin: FFMPEG process stdin opened with bufsize=0
+            frame: Contiguous BGR frame as a numpy array
+            
+        Returns:
+            True if the frame was written, False if it was dropped
+        """
+        fd = stdin.fileno()
+        _, writable, _ = select.select([], [fd], [], 0)
+        if not writable:
+            return False
+        
+        view = memoryview(frame).cast('B')
+        while view:
+            try:
+                written = stdin.write(view)
+            except BlockingIOError:
+                written = None
+            if written is None:
+                # Pipe full mid-frame: wait for FFMPEG to drain it
+                if self.stop_event.is_set():
+                    break
+                select.select([], [fd], [], self.PIPE_WAIT_INTERVAL)
+                continue
+            view = view[written:]
+        return True
+    
     def stop_streaming(self):
         """Stop streaming to RTSP server."""
         with self.lock:
@@ -154,39 +512,67 @@ class StreamManager:
             
             logger.info("Stopping RTSP streaming")
             self.is_streaming = False
-            self.stop_event.set()
-            
-            # Wait for stream thread to finish
-            if self.stream_thread and self.stream_thread.is_alive():
-                self.stream_thread.join(timeout=2)
+            if self.recording_path:
+                # The recording shares this FFMPEG process, which keeps
+                # publishing until stop_recording() finalizes the file
+                logger.info("RTSP output stops with the current recording")
+                return
+            self._terminate_ffmpeg()
             
-            # Terminate FFMPEG process
-            if self.ffmpeg_process:
-                try:
+            logger.info("RTSP streaming stopped")
+    
+    def _terminate_ffmpeg(self):
+        """Stop the frame feeder thread and the FFMPEG process."""
+        self.stop_event.set()
+        if self._frame_queue is not None:
+            # Wake the worker if it is waiting for a frame
+            put_latest(self._frame_queue, None)
+        
+        # Wait for stream thread to finish
+        if self.stream_thread and self.stream_thread.is_alive():
+            self.stream_thread.join(timeout=2)
+        self.stream_thread = None
+        
+        if self._frame_queue is not None:
+            self._camera.remove_frame_queue(self._frame_queue)
+            self._frame_queue = None
+        
+        # Terminate FFMPEG process. Closing stdin lets it flush and write the
+        # file trailer of a recording before it is asked to terminate
+        if self.ffmpeg_process:
+            try:
+                if self.ffmpeg_process.stdin:
                     self.ffmpeg_process.stdin.close()
+                    try:
+                        self.ffmpeg_process.wait(timeout=2)
+                    except subprocess.TimeoutExpired:
+                        pass
+                if self.ffmpeg_process.poll() is None:
                     self.ffmpeg_process.terminate()
                     try:
                         self.ffmpeg_process.wait(timeout=2)
                     except subprocess.TimeoutExpired:
                         logger.warning("FFMPEG process did not terminate, killing it")
                         self.ffmpeg_process.kill()
-                except Exception as e:
-                    logger.error(f"Error stopping FFMPEG: {e}")
-                    try:
-                        self.ffmpeg_process.kill()
-                    except (ProcessLookupError, AttributeError):
-                        # ProcessLookupError: process already terminated
-                        # AttributeError: ffmpeg_process is None
-                        pass
-                finally:
-                    self.ffmpeg_process = None
-            
-            logger.info("RTSP streaming stopped")
+            except Exception as e:
+                logger.error(f"Error stopping FFMPEG: {e}")
+                try:
+                    self.ffmpeg_process.kill()
+                except (ProcessLookupError, AttributeError):
+                    # ProcessLookupError: process already terminated
+                    # AttributeError: ffmpeg_process is None
+                    pass
+            finally:
+                self.ffmpeg_process = None
     
     def is_active(self):
         """Check if streaming is currently active."""
         return self.is_streaming
     
+    def is_direct_capture(self):
+        """Check if FFMPEG is currently reading the webcam device itself."""
+        return self.is_streaming and self._direct
+    
     def get_rtsp_url(self):
         """Get the RTSP URL for clients."""
         # Return public URL (replace mediamtx hostname with actual host)
@@ -197,11 +583,20 @@ class StreamManager:
 
 # Global stream manager instance
 stream_manager_instance = None
+_stream_manager_lock = threading.Lock()
 
 
 def get_stream_manager(config):
-    """Get or create the global stream manager instance."""
+    """Get or create the global stream manager instance.
+    
+    Thread-safe: concurrent first calls create a single instance, while
+    later calls return it without taking the lock.
+    """
     global stream_manager_instance
-    if stream_manager_instance is None:
-        stream_manager_instance = StreamManager(config)
-    return stream_manager_instance
+    instance = stream_manager_instance
+    if instance is None:
+        with _stream_manager_lock:
+            if stream_manager_instance is None:
+                stream_manager_instance = StreamManager(config)
+            instance = stream_manager_instance
+    return instance
@@ -14,7 +14,11 @@ class Config:
     CAMERA_WIDTH = int(os.environ.get('CAMERA_WIDTH', 640))
     CAMERA_HEIGHT = int(os.environ.get('CAMERA_HEIGHT', 480))
     CAMERA_FPS = int(os.environ.get('CAMERA_FPS', 30))
+    CAMERA_FOURCC = os.environ.get('CAMERA_FOURCC', 'MJPG')  # Pixel format requested from the device (empty for driver default)
     CAMERA_IDLE_TIMEOUT = int(os.environ.get('CAMERA_IDLE_TIMEOUT', 10))  # Seconds before releasing camera when idle
+    CAMERA_STREAM_FPS = int(os.environ.get('CAMERA_STREAM_FPS', 15))  # Max FPS for MJPEG viewers (recording uses CAMERA_FPS)
+    CAMERA_STREAM_SCALE = float(os.environ.get('CAMERA_STREAM_SCALE', 1.0))  # MJPEG frame size relative to capture (e.g. 0.5)
+    JPEG_QUALITY = int(os.environ.get('JPEG_QUALITY', 80))  # MJPEG stream quality (0-100)
     
     # Recording settings
     RECORDINGS_DIR = os.environ.get('RECORDINGS_DIR') or os.path.join(
@@ -22,18 +26,28 @@ class Config:
     )
     VIDEO_CODEC = os.environ.get('VIDEO_CODEC', 'mp4v')
     VIDEO_FORMAT = os.environ.get('VIDEO_FORMAT', 'mp4')
+    # Hardware H.264 encoding through GStreamer (requires OpenCV built with GStreamer)
+    HW_ENCODE = os.environ.get('HW_ENCODE', 'False').lower() == 'true'
+    HW_ENCODER = os.environ.get('HW_ENCODER', 'vaapih264enc')  # e.g. vaapih264enc, nvh264enc, v4l2h264enc
     
     # Server settings
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = int(os.environ.get('PORT', 5000))
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
-    WORKERS = int(os.environ.get('WORKERS', 4))  # Number of Gunicorn workers
+    WORKERS = int(os.environ.get('WORKERS', 1))  # Gunicorn worker processes (each opens the camera)
+    THREADS = int(os.environ.get('THREADS', 32))  # Threads per worker, one per concurrent viewer/request
+    # Let a front-end server send recording downloads (Apache/lighttpd X-Sendfile)
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'False').lower() == 'true'
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '')  # nginx internal location, e.g. /internal_recordings/
     
     # RTSP streaming settings
     RTSP_ENABLED = os.environ.get('RTSP_ENABLED', 'True').lower() == 'true'
     RTSP_OUTPUT_URL = os.environ.get('RTSP_OUTPUT_URL', 'rtsp://mediamtx:8554/live')
     RTSP_PUBLIC_HOST = os.environ.get('RTSP_PUBLIC_HOST', 'localhost')
     RTSP_PUBLIC_PORT = os.environ.get('RTSP_PUBLIC_PORT', '8554')
+    RTSP_ENCODER = os.environ.get('RTSP_ENCODER', 'auto')  # auto, libx264, h264_nvenc, h264_vaapi, h264_qsv
+    RTSP_DIRECT_CAPTURE = os.environ.get('RTSP_DIRECT_CAPTURE', 'False').lower() == 'true'  # FFMPEG reads /dev/videoN when the camera is idle
+    RTSP_TEE_RECORDING = os.environ.get('RTSP_TEE_RECORDING', 'False').lower() == 'true'  # Record from the RTSP encode while streaming
 
 
 class DevelopmentConfig(Config):
@@ -1,13 +1,8 @@
 #!/bin/bash
 # Entrypoint script for production deployment with Gunicorn
-# Reads WORKERS environment variable to configure the number of workers
+# Server settings (HOST, PORT, WORKERS, THREADS, TIMEOUT) are read from the
+# environment by gunicorn.conf.py
 
-# Default values
-WORKERS=${WORKERS:-4}
-BIND=${HOST:-0.0.0.0}:${PORT:-5000}
-TIMEOUT=${TIMEOUT:-120}
+echo "Starting Gunicorn with ${WORKERS:-1} worker(s) x ${THREADS:-32} threads on ${HOST:-0.0.0.0}:${PORT:-5000}"
 
-echo "Starting Gunicorn with $WORKERS workers on $BIND (timeout: ${TIMEOUT}s)"
-
-# Start Gunicorn with configured workers
-exec gunicorn --bind "$BIND" --workers "$WORKERS" --timeout "$TIMEOUT" wsgi:app
+exec gunicorn --config gunicorn.conf.py wsgi:app
@@ -0,0 +1,15 @@
+"""Gunicorn configuration for production deployment."""
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+
+# The webcam is owned by a single process, so requests are served by that
+# process's threads: every MJPEG viewer holds a thread for as long as it
+# watches, while the capture, RTSP and recording workers keep running
+workers = int(os.environ.get('WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 32))
+
+# gthread workers heartbeat from their main thread, so long-lived video
+# streams are not killed by the timeout
+timeout = int(os.environ.get('TIMEOUT', 120))
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 """Main entry point for the webcam recorder application."""
-from app import app
+from app import create_app
 
 
+app = create_app()
+
 if __name__ == '__main__':
-    # Run the application
+    # Run the development server; use entrypoint.sh (Gunicorn) in production.
+    # Each MJPEG viewer holds its connection open, so serve one per thread
     app.run(
         host=app.config['HOST'],
         port=app.config['PORT'],
-        debug=app.config['DEBUG']
+        debug=app.config['DEBUG'],
+        threaded=True
     )